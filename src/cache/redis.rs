@@ -24,21 +24,41 @@ use futures::{future, Future};
 use redis::{
     cmd,
     Client,
+    Cmd,
+    ConnectionAddr,
+    ConnectionInfo,
+    ErrorKind as RedisErrorKind,
+    FromRedisValue,
     InfoDict,
+    IntoConnectionInfo,
+    RedisFuture,
 };
 use redis::async::Connection;
+use std::cell::RefCell;
 use std::collections::HashMap;
 use std::io::Cursor;
+use std::net::ToSocketAddrs;
+use std::rc::Rc;
 use std::time::{
     Duration,
     Instant,
 };
 
+/// How long a resolved server address is used before looking it up again.
+const DNS_CACHE_TTL: Duration = Duration::from_secs(60);
+
+/// The most idle connections kept around for reuse.
+const MAX_IDLE_CONNECTIONS: usize = 8;
+
 /// A cache that stores entries in a Redis.
 #[derive(Clone)]
 pub struct RedisCache {
     url: String,
-    client: Client,
+    info: ConnectionInfo,
+    /// A client for the resolved server address, and when it expires.
+    resolved: Rc<RefCell<Option<(Client, Instant)>>>,
+    /// Connections that finished a request successfully and can be reused.
+    idle: Rc<RefCell<Vec<Connection>>>,
 }
 
 impl RedisCache {
@@ -46,28 +66,109 @@ impl RedisCache {
     pub fn new(url: &str) -> Result<RedisCache> {
         Ok(RedisCache {
             url: url.to_owned(),
-            client: Client::open(url)?,
+            info: url.into_connection_info()?,
+            resolved: Rc::new(RefCell::new(None)),
+            idle: Rc::new(RefCell::new(Vec::new())),
         })
     }
 
-    /// Returns a connection with configured read and write timeouts.
+    /// Returns a client for the server, resolving its hostname at most once
+    /// every `DNS_CACHE_TTL` rather than on every connection.
+    fn client(&self) -> Result<Client> {
+        let now = Instant::now();
+        if let Some((ref client, expires_at)) = *self.resolved.borrow() {
+            if now < expires_at {
+                return Ok(client.clone());
+            }
+        }
+        let client = Client::open(resolve(&self.info)?)?;
+        *self.resolved.borrow_mut() = Some((client.clone(), now + DNS_CACHE_TTL));
+        Ok(client)
+    }
+
+    /// Opens a new connection to the server.
     fn connect(&self) -> impl Future<Item = Connection, Error = Error> {
-        self.client.get_async_connection()
-            .map_err(|e| e.into())
+        future::result(self.client())
+            .and_then(|client| client.get_async_connection().from_err())
+    }
+
+    /// Run `cmd` on an idle connection if there is one, or on a new one.
+    ///
+    /// The server may have closed an idle connection since it was last used
+    /// (its `timeout` setting, a restart, a proxy dropping idle sockets), so
+    /// if the connection turns out to be dead `cmd` is tried once more on a
+    /// new one. Error replies from the server are returned as they are.
+    /// Connections are only kept for reuse after a successful command.
+    fn query<T>(&self, cmd: Cmd) -> SFuture<T>
+    where
+        T: FromRedisValue + Send + 'static,
+    {
+        let cmd = Rc::new(cmd);
+        let idle = self.idle.borrow_mut().pop();
+        let result: SFuture<(Connection, T)> = match idle {
+            Some(c) => {
+                let me = self.clone();
+                let retry_cmd = cmd.clone();
+                Box::new(run::<T>(&cmd, c).or_else(move |e| -> SFuture<_> {
+                    if e.kind() != RedisErrorKind::IoError {
+                        return f_err(e);
+                    }
+                    debug!("Redis connection was closed while idle, retrying: {}", e);
+                    Box::new(
+                        me.connect()
+                            .and_then(move |c| run::<T>(&retry_cmd, c).from_err())
+                    )
+                }))
+            }
+            None => Box::new(
+                self.connect()
+                    .and_then(move |c| run::<T>(&cmd, c).from_err())
+            ),
+        };
+        let me = self.clone();
+        Box::new(result.map(move |(c, v)| {
+            me.release(c);
+            v
+        }))
+    }
+
+    /// Keep `c` around for a later request.
+    fn release(&self, c: Connection) {
+        let mut idle = self.idle.borrow_mut();
+        if idle.len() < MAX_IDLE_CONNECTIONS {
+            idle.push(c);
+        }
     }
 }
 
+/// Returns `info` with a TCP server's hostname replaced by its address.
+fn resolve(info: &ConnectionInfo) -> Result<ConnectionInfo> {
+    let mut info = info.clone();
+    if let ConnectionAddr::Tcp(ref mut host, port) = *info.addr {
+        let addr = (&host[..], port).to_socket_addrs()?
+            .next()
+            .ok_or_else(|| format!("Failed to resolve redis host `{}`", host))?;
+        *host = addr.ip().to_string();
+    }
+    Ok(info)
+}
+
+/// Run `cmd` on `c`, handing the connection back along with the result.
+fn run<T>(cmd: &Cmd, c: Connection) -> RedisFuture<(Connection, T)>
+where
+    T: FromRedisValue + Send + 'static,
+{
+    cmd.query_async(c)
+}
+
 impl Storage for RedisCache {
-    /// Open a connection and query for a key.
+    /// Query for a key.
     fn get(&self, key: &str) -> SFuture<Cache> {
-        let key = key.to_owned();
-        let me = self.clone();
+        let mut get = cmd("GET");
+        get.arg(key);
         Box::new(
-            me.connect()
-                .and_then(|c| {
-                    cmd("GET").arg(key).query_async(c).from_err()
-                })
-                .and_then(|(_, d): (_, Vec<u8>)| {
+            self.query(get)
+                .and_then(|d: Vec<u8>| {
                     if d.is_empty() {
                         Ok(Cache::Miss)
                     } else {
@@ -78,20 +179,13 @@ impl Storage for RedisCache {
         )
     }
 
-    /// Open a connection and store a object in the cache.
+    /// Store an object in the cache.
     fn put(&self, key: &str, entry: CacheWrite) -> SFuture<Duration> {
-        let key = key.to_owned();
-        let me = self.clone();
         let start = Instant::now();
-        Box::new(
-            me.connect()
-                .and_then(move |c| {
-                    future::result(entry.finish()).and_then(|d| {
-                        cmd("SET").arg(key).arg(d).query_async(c).from_err()
-                    })
-                })
-                .map(move |(_, ())| start.elapsed())
-        )
+        let d = ftry!(entry.finish());
+        let mut set = cmd("SET");
+        set.arg(key).arg(d);
+        Box::new(self.query(set).map(move |()| start.elapsed()))
     }
 
     /// Returns the cache location.
@@ -103,9 +197,7 @@ impl Storage for RedisCache {
     /// the Redis INFO command (used_memory).
     fn current_size(&self) -> SFuture<Option<u64>> {
         Box::new(
-            self.connect()
-                .and_then(|c| cmd("INFO").query_async(c).from_err())
-                .map(|(_, v)| v)
+            self.query(cmd("INFO"))
                 .map(|i: InfoDict| i.get("used_memory"))
         )
     }
@@ -114,10 +206,10 @@ impl Storage for RedisCache {
     /// the Redis CONFIG command (maxmemory). If the server has no
     /// configured limit, the result is None.
     fn max_size(&self) -> SFuture<Option<u64>> {
+        let mut config = cmd("CONFIG");
+        config.arg("GET").arg("maxmemory");
         Box::new(
-            self.connect()
-                .and_then(|c| cmd("CONFIG").arg("GET").arg("maxmemory").query_async(c).from_err())
-                .map(|(_, v)| v)
+            self.query(config)
                 .map(|h: HashMap<String, usize>| {
                     h.get("maxmemory").and_then(|&s| {
                         if s != 0 {
@@ -130,3 +222,134 @@ impl Storage for RedisCache {
         )
     }
 }
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use std::io::{BufRead, BufReader, Read, Write};
+    use std::net::TcpListener;
+    use std::sync::Arc;
+    use std::sync::atomic::{AtomicUsize, Ordering};
+    use std::thread;
+    use tokio::runtime::current_thread::Runtime;
+
+    /// Read one command from `r`, returning false at EOF.
+    fn read_command<R: BufRead>(r: &mut R) -> bool {
+        let mut line = String::new();
+        if r.read_line(&mut line).unwrap_or(0) == 0 {
+            return false;
+        }
+        let args: usize = line[1..].trim().parse().unwrap();
+        for _ in 0..args {
+            line.clear();
+            r.read_line(&mut line).unwrap();
+            let len: usize = line[1..].trim().parse().unwrap();
+            let mut arg = vec![0; len + 2];
+            r.read_exact(&mut arg).unwrap();
+        }
+        true
+    }
+
+    const NIL: &[u8] = b"$-1\r\n";
+
+    /// Start a fake server that answers the `n`th command on each connection
+    /// with `reply(n)`, closing the connection when that is `None`. Returns
+    /// the server's url and a count of the connections it has accepted.
+    fn fake_server<F>(reply: F) -> (String, Arc<AtomicUsize>)
+    where
+        F: Fn(usize) -> Option<&'static [u8]> + Send + 'static,
+    {
+        let listener = TcpListener::bind("127.0.0.1:0").unwrap();
+        let url = format!("redis://{}/", listener.local_addr().unwrap());
+        let accepted = Arc::new(AtomicUsize::new(0));
+        let counter = accepted.clone();
+        thread::spawn(move || {
+            for stream in listener.incoming() {
+                let mut stream = stream.unwrap();
+                counter.fetch_add(1, Ordering::SeqCst);
+                let mut reader = BufReader::new(stream.try_clone().unwrap());
+                for n in 0.. {
+                    let reply = match reply(n) {
+                        Some(reply) => reply,
+                        None => break,
+                    };
+                    if !read_command(&mut reader) {
+                        break;
+                    }
+                    stream.write_all(reply).unwrap();
+                }
+            }
+        });
+        (url, accepted)
+    }
+
+    fn assert_miss(cache: Cache) {
+        match cache {
+            Cache::Miss => {}
+            c => panic!("Unexpected cache result: {:?}", c),
+        }
+    }
+
+    #[test]
+    fn test_reuses_connections() {
+        let (url, accepted) = fake_server(|_| Some(NIL));
+        let cache = RedisCache::new(&url).unwrap();
+        let mut runtime = Runtime::new().unwrap();
+        for _ in 0..3 {
+            assert_miss(runtime.block_on(cache.get("foo")).unwrap());
+        }
+        assert_eq!(1, accepted.load(Ordering::SeqCst));
+    }
+
+    #[test]
+    fn test_retries_closed_idle_connection() {
+        let (url, accepted) = fake_server(|n| if n == 0 { Some(NIL) } else { None });
+        let cache = RedisCache::new(&url).unwrap();
+        let mut runtime = Runtime::new().unwrap();
+        assert_miss(runtime.block_on(cache.get("foo")).unwrap());
+        // The server has closed the idle connection, so this has to retry on a
+        // new one.
+        assert_miss(runtime.block_on(cache.get("foo")).unwrap());
+        assert_eq!(2, accepted.load(Ordering::SeqCst));
+    }
+
+    #[test]
+    fn test_does_not_retry_error_replies() {
+        let (url, accepted) = fake_server(|n| {
+            Some(if n == 0 { NIL } else { &b"-ERR out of memory\r\n"[..] })
+        });
+        let cache = RedisCache::new(&url).unwrap();
+        let mut runtime = Runtime::new().unwrap();
+        assert_miss(runtime.block_on(cache.get("foo")).unwrap());
+        // The idle connection is fine; the server just refused the command.
+        assert!(runtime.block_on(cache.get("foo")).is_err());
+        assert_eq!(1, accepted.load(Ordering::SeqCst));
+    }
+
+    #[test]
+    fn test_resolve() {
+        let info = resolve(&"redis://localhost:6379/".into_connection_info().unwrap()).unwrap();
+        match *info.addr {
+            ConnectionAddr::Tcp(ref host, port) => {
+                assert!(host == "127.0.0.1" || host == "::1", "unexpected host {}", host);
+                assert_eq!(6379, port);
+            }
+            _ => panic!("Expected a TCP address"),
+        }
+    }
+
+    #[test]
+    fn test_client_caches_resolution() {
+        let mut cache = RedisCache::new("redis://localhost:6379/").unwrap();
+        assert!(cache.client().is_ok());
+        // Within the TTL the resolved client is reused, so the host isn't
+        // looked up again.
+        cache.info = "redis://nonexistent.invalid/".into_connection_info().unwrap();
+        assert!(cache.client().is_ok());
+        // Once it expires, the host is resolved again.
+        if let Some((_, ref mut expires_at)) = *cache.resolved.borrow_mut() {
+            *expires_at = Instant::now();
+        }
+        assert!(cache.client().is_err());
+    }
+}
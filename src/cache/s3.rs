@@ -21,10 +21,13 @@ use cache::{
 use directories::UserDirs;
 use futures::future;
 use futures::future::Future;
+use futures_cpupool::CpuPool;
+use hyper::StatusCode;
 use simples3::{
     AutoRefreshingProvider,
     Bucket,
     ChainProvider,
+    content_md5,
     ProfileProvider,
     ProvideAwsCredentials,
     Ssl,
@@ -41,11 +44,13 @@ pub struct S3Cache {
     bucket: Rc<Bucket>,
     /// Credentials provider.
     provider: AutoRefreshingProvider<ChainProvider>,
+    /// Thread pool to prepare uploads on.
+    pool: CpuPool,
 }
 
 impl S3Cache {
     /// Create a new `S3Cache` storing data in `bucket`.
-    pub fn new(bucket: &str, endpoint: &str) -> Result<S3Cache> {
+    pub fn new(bucket: &str, endpoint: &str, pool: &CpuPool) -> Result<S3Cache> {
         let user_dirs = UserDirs::new().ok_or("Couldn't get user directories")?;
         let home = user_dirs.home_dir();
 
@@ -62,6 +67,7 @@ impl S3Cache {
         Ok(S3Cache {
             bucket: bucket,
             provider: provider,
+            pool: pool.clone(),
         })
     }
 }
@@ -70,37 +76,57 @@ fn normalize_key(key: &str) -> String {
     format!("{}/{}/{}/{}", &key[0..1], &key[1..2], &key[2..3], &key)
 }
 
+/// Turn the result of a bucket GET into a cache lookup result.
+fn cache_from_response(result: Result<Vec<u8>>) -> Result<Cache> {
+    match result {
+        Ok(data) => {
+            let hit = CacheRead::from(io::Cursor::new(data))?;
+            Ok(Cache::Hit(hit))
+        }
+        Err(Error(ErrorKind::BadHTTPStatus(status), _)) if status == StatusCode::NOT_FOUND => {
+            Ok(Cache::Miss)
+        }
+        // S3 answers 403 rather than 404 for missing keys when the requester
+        // can't list the bucket. GETs are sent unauthenticated, though, so a
+        // private or misconfigured bucket answers 403 for every key: keep
+        // treating it as a miss, but make it visible.
+        Err(Error(ErrorKind::BadHTTPStatus(status), _)) if status == StatusCode::FORBIDDEN => {
+            warn!("Got 403 Forbidden from S3, treating it as a cache miss. \
+                   Cache reads are unauthenticated, so the bucket must allow public reads.");
+            Ok(Cache::Miss)
+        }
+        // Anything else, e.g. a timeout or a server error, isn't a miss;
+        // report it so it shows up as a cache read error.
+        Err(e) => {
+            warn!("Got AWS error: {:?}", e);
+            Err(e)
+        }
+    }
+}
+
 impl Storage for S3Cache {
     fn get(&self, key: &str) -> SFuture<Cache> {
         let key = normalize_key(key);
-        Box::new(self.bucket.get(&key).then(|result| {
-            match result {
-                Ok(data) => {
-                    let hit = CacheRead::from(io::Cursor::new(data))?;
-                    Ok(Cache::Hit(hit))
-                }
-                Err(e) => {
-                    warn!("Got AWS error: {:?}", e);
-                    Ok(Cache::Miss)
-                }
-            }
-        }))
+        Box::new(self.bucket.get(&key).then(cache_from_response))
     }
 
     fn put(&self, key: &str, entry: CacheWrite) -> SFuture<Duration> {
         let key = normalize_key(&key);
         let start = Instant::now();
-        let data = match entry.finish() {
-            Ok(data) => data,
-            Err(e) => return f_err(e),
-        };
+        // Finishing the entry and hashing it for the upload both touch all of
+        // its data, so keep them off the event loop.
+        let data = self.pool.spawn_fn(move || -> Result<_> {
+            let data = entry.finish()?;
+            let md5 = content_md5(&data);
+            Ok((data, md5))
+        });
         let credentials = self.provider.credentials().chain_err(|| {
             "failed to get AWS credentials"
         });
 
         let bucket = self.bucket.clone();
-        let response = credentials.and_then(move |credentials| {
-            bucket.put(&key, data, &credentials).chain_err(|| {
+        let response = data.join(credentials).and_then(move |((data, md5), credentials)| {
+            bucket.put(&key, data, &md5, &credentials).chain_err(|| {
                 "failed to put cache entry in s3"
             })
         });
@@ -115,3 +141,29 @@ impl Storage for S3Cache {
     fn current_size(&self) -> SFuture<Option<u64>> { Box::new(future::ok(None)) }
     fn max_size(&self) -> SFuture<Option<u64>> { Box::new(future::ok(None)) }
 }
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    fn status_error(status: StatusCode) -> Result<Vec<u8>> {
+        Err(ErrorKind::BadHTTPStatus(status).into())
+    }
+
+    #[test]
+    fn test_cache_from_response() {
+        match cache_from_response(status_error(StatusCode::NOT_FOUND)) {
+            Ok(Cache::Miss) => {}
+            r => panic!("Unexpected result: {:?}", r),
+        }
+        match cache_from_response(status_error(StatusCode::FORBIDDEN)) {
+            Ok(Cache::Miss) => {}
+            r => panic!("Unexpected result: {:?}", r),
+        }
+        match cache_from_response(status_error(StatusCode::INTERNAL_SERVER_ERROR)) {
+            Err(Error(ErrorKind::BadHTTPStatus(status), _))
+                if status == StatusCode::INTERNAL_SERVER_ERROR => {}
+            r => panic!("Unexpected result: {:?}", r),
+        }
+    }
+}
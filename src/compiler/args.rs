@@ -586,20 +586,23 @@ where
 
     fn next(&mut self) -> Option<Self::Item> {
         if let Some(arg) = self.arguments.next() {
-            let s = arg.to_string_lossy();
-            let arguments = &mut self.arguments;
-            Some(match self.arg_info.search(&s[..]) {
-                Some(i) => {
-                    i.clone().process(&s[..], || arguments.next())
-                }
-                None => {
-                    Ok(if s.starts_with("-") {
-                        Argument::UnknownFlag(arg.clone())
-                    } else {
-                        Argument::Raw(arg.clone())
-                    })
+            let is_flag = {
+                let s = arg.to_string_lossy();
+                let arguments = &mut self.arguments;
+                match self.arg_info.search(&s[..]) {
+                    Some(i) => {
+                        return Some(i.clone().process(&s[..], || arguments.next()));
+                    }
+                    None => s.starts_with("-"),
                 }
-            })
+            };
+            // Unknown arguments are kept as-is, so hand over `arg` rather
+            // than copying it.
+            Some(Ok(if is_flag {
+                Argument::UnknownFlag(arg)
+            } else {
+                Argument::Raw(arg)
+            }))
         } else {
             None
         }
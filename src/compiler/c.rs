@@ -240,6 +240,7 @@ impl<T, I> CompilerHasher<T> for CCompilerHasher<I>
         });
         let out_pretty = parsed_args.output_pretty().into_owned();
         let extra_hashes = hash_all(&parsed_args.extra_hash_files, &pool.clone());
+        let pool = pool.clone();
 
         Box::new(result.or_else(move |err| {
             match err {
@@ -262,30 +263,46 @@ impl<T, I> CompilerHasher<T> for CCompilerHasher<I>
                    preprocessor_result.stdout.len());
 
             Box::new(extra_hashes.and_then(move |extra_hashes| {
-                let key = {
-                    hash_key(&executable_digest,
-                             parsed_args.language,
-                             &parsed_args.common_args,
-                             &extra_hashes,
-                             &env_vars,
-                             &preprocessor_result.stdout)
-                };
-                // A compiler binary may be a symlink to another and so has the same digest, but that means
-                // the toolchain will not contain the correct path to invoke the compiler! Add the compiler
-                // executable path to try and prevent this
-                let weak_toolchain_key = format!("{}-{}", executable.to_string_lossy(), executable_digest);
-                Ok(HashResult {
-                    key: key,
-                    compilation: Box::new(CCompilation {
-                        parsed_args: parsed_args,
-                        #[cfg(feature = "dist-client")]
-                        preprocessed_input: preprocessor_result.stdout,
-                        executable: executable,
-                        compiler: compiler,
-                        cwd,
-                        env_vars,
-                    }),
-                    weak_toolchain_key,
+                // Preprocessor output can run to tens of megabytes, so hash it
+                // on the pool rather than stalling the event loop while we do.
+                let language = parsed_args.language;
+                let common_args = parsed_args.common_args.clone();
+                let compiler_digest = executable_digest.clone();
+                let hash_env_vars = env_vars.clone();
+                let preprocessed_input = preprocessor_result.stdout;
+                let key = pool.spawn_fn(move || -> Result<_> {
+                    let key = hash_key(&compiler_digest,
+                                       language,
+                                       &common_args,
+                                       &extra_hashes,
+                                       &hash_env_vars,
+                                       &preprocessed_input);
+                    // The preprocessor output is only needed again to send the
+                    // compile to a dist server; otherwise free it now rather
+                    // than holding it in memory until the compile finishes.
+                    let preprocessed_input = if may_dist { preprocessed_input } else { vec![] };
+                    Ok((key, preprocessed_input))
+                });
+                key.map(move |(key, preprocessed_input)| {
+                    #[cfg(not(feature = "dist-client"))]
+                    let _ = preprocessed_input;
+                    // A compiler binary may be a symlink to another and so has the same digest, but that means
+                    // the toolchain will not contain the correct path to invoke the compiler! Add the compiler
+                    // executable path to try and prevent this
+                    let weak_toolchain_key = format!("{}-{}", executable.to_string_lossy(), executable_digest);
+                    HashResult {
+                        key: key,
+                        compilation: Box::new(CCompilation {
+                            parsed_args: parsed_args,
+                            #[cfg(feature = "dist-client")]
+                            preprocessed_input: preprocessed_input,
+                            executable: executable,
+                            compiler: compiler,
+                            cwd,
+                            env_vars,
+                        }),
+                        weak_toolchain_key,
+                    }
                 })
             }))
         }))
@@ -397,7 +414,7 @@ impl pkg::ToolchainPackager for CToolchainPackager {
 }
 
 /// The cache is versioned by the inputs to `hash_key`.
-pub const CACHE_VERSION: &[u8] = b"7";
+pub const CACHE_VERSION: &[u8] = b"8";
 
 lazy_static! {
     /// Environment variables that are factored into the cache key.
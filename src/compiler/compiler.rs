@@ -29,7 +29,7 @@ use std::borrow::Cow;
 use std::collections::HashMap;
 use std::ffi::OsString;
 use std::fmt;
-#[cfg(any(feature = "dist-client", unix))]
+#[cfg(feature = "dist-client")]
 use std::fs;
 use std::fs::File;
 use std::io::prelude::*;
@@ -206,10 +206,12 @@ where
                                 // happening in parallel don't see a partially-written file.
                                 let mut tmp = NamedTempFile::new_in(dir)?;
                                 let mode = entry.get_object(&key, &mut tmp)?;
-                                tmp.persist(path)?;
+                                // Set the mode through the open handle before the rename,
+                                // saving a path lookup per output.
                                 if let Some(mode) = mode {
-                                    set_file_mode(&path, mode)?;
+                                    set_file_mode(tmp.as_file(), mode)?;
                                 }
+                                tmp.persist(path)?;
                             }
                             Ok(())
                         });
@@ -291,9 +293,20 @@ where
                             fmt_duration_as_secs(&duration)
                         );
                         let write = pool.spawn_fn(move || -> Result<_> {
-                            let mut entry = CacheWrite::new();
+                            // Reserve room for the entry up front rather than growing
+                            // and copying its buffer from empty as objects are added.
+                            // Outputs are zstd-compressed into it, and object files
+                            // usually shrink to well under half their size, so start
+                            // from a quarter of their total and let it grow if needed.
+                            let mut files = Vec::with_capacity(outputs.len());
+                            let mut size = 0;
                             for (key, path) in &outputs {
-                                let mut f = File::open(&path)?;
+                                let f = File::open(&path)?;
+                                size += f.metadata()?.len();
+                                files.push((key, path, f));
+                            }
+                            let mut entry = CacheWrite::with_capacity((size / 4) as usize);
+                            for (key, path, mut f) in files {
                                 let mode = get_file_mode(&f)?;
                                 entry.put_object(key, &mut f, mode).chain_err(|| {
                                     format!("failed to put object `{:?}` in zip", path)
@@ -746,16 +759,16 @@ fn get_file_mode(_file: &File) -> Result<Option<u32>> {
 }
 
 #[cfg(unix)]
-fn set_file_mode(path: &Path, mode: u32) -> Result<()> {
+fn set_file_mode(file: &File, mode: u32) -> Result<()> {
     use std::fs::Permissions;
     use std::os::unix::fs::PermissionsExt;
     let p = Permissions::from_mode(mode);
-    fs::set_permissions(path, p)?;
+    file.set_permissions(p)?;
     Ok(())
 }
 
 #[cfg(windows)]
-fn set_file_mode(_path: &Path, _mode: u32) -> Result<()> {
+fn set_file_mode(_file: &File, _mode: u32) -> Result<()> {
     Ok(())
 }
 
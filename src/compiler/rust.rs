@@ -187,7 +187,7 @@ lazy_static! {
 }
 
 /// Version number for cache key.
-const CACHE_VERSION: &[u8] = b"3";
+const CACHE_VERSION: &[u8] = b"4";
 
 /// Get absolute paths for all source files listed in rustc's dep-info output.
 fn get_source_files<T>(creator: &T,
@@ -985,10 +985,23 @@ impl<T> CompilerHasher<T> for RustHasher
         trace!("[{}]: hashing {} staticlibs", crate_name, staticlibs.len());
         let abs_staticlibs = staticlibs.iter().map(|s| cwd.join(s)).collect::<Vec<_>>();
         let staticlib_hashes = hash_all(&abs_staticlibs, pool);
-        let creator = creator.clone();
-        let hashes = source_files_and_hashes.join3(extern_hashes, staticlib_hashes);
-        Box::new(hashes.and_then(move |((source_files, source_hashes), extern_hashes, staticlib_hashes)|
-                                        -> SFuture<_> {
+        // Filter out RUSTC_COLOR since we control color usage with command line flags.
+        // rustc reports an error when both are present.
+        let mut env_vars: Vec<_> = env_vars.iter()
+            .filter(|(ref k, _)| k != "RUSTC_COLOR")
+            .cloned()
+            .collect();
+        env_vars.sort();
+        // Turn arguments into a simple Vec<OsString> to calculate outputs.
+        let flat_os_string_arguments: Vec<OsString> = os_string_arguments.iter()
+            .flat_map(|&(ref arg, ref val)| iter::once(arg).chain(val))
+            .cloned()
+            .collect();
+        // Ask rustc for the output file names while the inputs are being
+        // hashed, instead of waiting for all the hashing to finish first.
+        let outputs = get_compiler_outputs(creator, &executable, &flat_os_string_arguments, &cwd, &env_vars);
+        let hashes = source_files_and_hashes.join4(extern_hashes, staticlib_hashes, outputs);
+        Box::new(hashes.map(move |((source_files, source_hashes), extern_hashes, staticlib_hashes, outputs)| {
             // If you change any of the inputs to the hash, you should change `CACHE_VERSION`.
             let mut m = Digest::new();
             // Hash inputs:
@@ -1043,13 +1056,6 @@ impl<T> CompilerHasher<T> for RustHasher
             // we'll just hash the CARGO_ env vars and hope that's sufficient.
             // Upstream Rust issue tracking getting information about env! usage:
             // https://github.com/rust-lang/rust/issues/40364
-            let mut env_vars: Vec<_> = env_vars.iter()
-                // Filter out RUSTC_COLOR since we control color usage with command line flags.
-                // rustc reports an error when both are present.
-                .filter(|(ref k, _)| k != "RUSTC_COLOR")
-                .cloned()
-                .collect();
-            env_vars.sort();
             for &(ref var, ref val) in env_vars.iter() {
                 // CARGO_MAKEFLAGS will have jobserver info which is extremely non-cacheable.
                 if var.starts_with("CARGO_") && var != "CARGO_MAKEFLAGS" {
@@ -1060,60 +1066,54 @@ impl<T> CompilerHasher<T> for RustHasher
             }
             // 8. The cwd of the compile. This will wind up in the rlib.
             cwd.hash(&mut HashToDigest { digest: &mut m });
-            // Turn arguments into a simple Vec<OsString> to calculate outputs.
-            let flat_os_string_arguments: Vec<OsString> = os_string_arguments.into_iter()
-                .flat_map(|(arg, val)| iter::once(arg).into_iter().chain(val))
-                .collect();
-            Box::new(get_compiler_outputs(&creator, &executable, &flat_os_string_arguments, &cwd, &env_vars).map(move |outputs| {
-                let output_dir = PathBuf::from(output_dir);
-                // Convert output files into a map of basename -> full path.
-                let mut outputs = outputs.into_iter()
-                    .map(|o| {
-                        let p = output_dir.join(&o);
-                        (o, p)
-                    })
-                    .collect::<HashMap<_, _>>();
-                let dep_info = if let Some(dep_info) = dep_info {
-                    let p = output_dir.join(&dep_info);
-                    outputs.insert(dep_info.to_string_lossy().into_owned(), p.clone());
-                    Some(p)
-                } else {
-                    None
-                };
-                let mut arguments = arguments;
-                // Always request color output, the client will strip colors if needed.
-                arguments.push(Argument::WithValue("--color", ArgData::Color("always".into()), ArgDisposition::Separated));
-                let inputs = source_files.into_iter().chain(abs_externs).chain(abs_staticlibs).collect();
-
-                if rename_rlib_to_rmeta {
-                    for output in outputs.values_mut() {
-                        if output.extension() == Some(OsStr::new("rlib")) {
-                            output.set_extension("rmeta");
-                        }
+            let output_dir = PathBuf::from(output_dir);
+            // Convert output files into a map of basename -> full path.
+            let mut outputs = outputs.into_iter()
+                .map(|o| {
+                    let p = output_dir.join(&o);
+                    (o, p)
+                })
+                .collect::<HashMap<_, _>>();
+            let dep_info = if let Some(dep_info) = dep_info {
+                let p = output_dir.join(&dep_info);
+                outputs.insert(dep_info.to_string_lossy().into_owned(), p.clone());
+                Some(p)
+            } else {
+                None
+            };
+            let mut arguments = arguments;
+            // Always request color output, the client will strip colors if needed.
+            arguments.push(Argument::WithValue("--color", ArgData::Color("always".into()), ArgDisposition::Separated));
+            let inputs = source_files.into_iter().chain(abs_externs).chain(abs_staticlibs).collect();
+
+            if rename_rlib_to_rmeta {
+                for output in outputs.values_mut() {
+                    if output.extension() == Some(OsStr::new("rlib")) {
+                        output.set_extension("rmeta");
                     }
                 }
+            }
 
-                HashResult {
-                    key: m.finish(),
-                    compilation: Box::new(RustCompilation {
-                        executable: executable,
-                        host,
-                        sysroot: sysroot,
-                        arguments: arguments,
-                        inputs: inputs,
-                        outputs: outputs,
-                        crate_link_paths,
-                        crate_name,
-                        crate_types,
-                        dep_info,
-                        cwd,
-                        env_vars,
-                        #[cfg(feature = "dist-client")]
-                        rlib_dep_reader,
-                    }),
-                    weak_toolchain_key,
-                }
-            }))
+            HashResult {
+                key: m.finish(),
+                compilation: Box::new(RustCompilation {
+                    executable: executable,
+                    host,
+                    sysroot: sysroot,
+                    arguments: arguments,
+                    inputs: inputs,
+                    outputs: outputs,
+                    crate_link_paths,
+                    crate_name,
+                    crate_types,
+                    dep_info,
+                    cwd,
+                    env_vars,
+                    #[cfg(feature = "dist-client")]
+                    rlib_dep_reader,
+                }),
+                weak_toolchain_key,
+            }
         }))
     }
 
@@ -35,6 +35,7 @@ use errors::*;
 lazy_static! {
     static ref CACHED_CONFIG_PATH: PathBuf = CachedConfig::file_config_path();
     static ref CACHED_CONFIG: Mutex<Option<CachedFileConfig>> = Mutex::new(None);
+    static ref SIZE_REGEX: Regex = Regex::new(r"^(\d+)([KMGT])$").expect("Fixed regex parse failure");
 }
 
 const ORGANIZATION: &str = "Mozilla";
@@ -69,8 +70,7 @@ fn default_disk_cache_size() -> u64 { TEN_GIGS }
 fn default_toolchain_cache_size() -> u64 { TEN_GIGS }
 
 pub fn parse_size(val: &str) -> Option<u64> {
-    let re = Regex::new(r"^(\d+)([KMGT])$").expect("Fixed regex parse failure");
-    re.captures(val)
+    SIZE_REGEX.captures(val)
         .and_then(|caps| {
             caps.get(1)
                 .and_then(|size| u64::from_str(size.as_str()).ok())
@@ -311,7 +311,7 @@ mod code_grant_pkce {
             res.json()
                 .chain_err(|| "Failed to parse token response as JSON")?,
         )?;
-        if expires_at - Instant::now() < MIN_TOKEN_VALIDITY {
+        if expires_at < Instant::now() + MIN_TOKEN_VALIDITY {
             warn!(
                 "Token retrieved expires in under {}",
                 MIN_TOKEN_VALIDITY_WARNING
@@ -446,7 +446,7 @@ mod implicit {
                 if auth_state != state.auth_state_value {
                     return ftry_send!(Err("Mismatched auth states after redirect"));
                 }
-                if expires_at - Instant::now() < MIN_TOKEN_VALIDITY {
+                if expires_at < Instant::now() + MIN_TOKEN_VALIDITY {
                     warn!(
                         "Token retrieved expires in under {}",
                         MIN_TOKEN_VALIDITY_WARNING
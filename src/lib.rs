@@ -107,6 +107,7 @@ extern crate which;
 #[cfg(windows)]
 extern crate winapi;
 extern crate zip;
+extern crate zstd;
 
 // To get macros in scope, this has to be first.
 #[cfg(test)]
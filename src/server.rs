@@ -26,6 +26,7 @@ use config::Config;
 use dist;
 use filetime::FileTime;
 use futures::sync::mpsc;
+use futures::future::Shared;
 use futures::task::{self, Task};
 use futures::{future, stream, Async, AsyncSink, Future, Poll, Sink, StartSend, Stream};
 use futures_cpupool::CpuPool;
@@ -520,6 +521,12 @@ struct SccacheService<C: CommandCreatorSync> {
     /// A cache of known compiler info.
     compilers: Rc<RefCell<HashMap<PathBuf, Option<(Box<Compiler<C>>, FileTime)>>>>,
 
+    /// Compiler info lookups that are still running, keyed by compiler path
+    /// and mtime, so that concurrent requests for the same compiler can wait
+    /// on a single lookup.
+    compilers_pending:
+        Rc<RefCell<HashMap<(PathBuf, FileTime), Shared<SFuture<Option<Box<Compiler<C>>>>>>>>,
+
     /// Thread pool to execute work in
     pool: CpuPool,
 
@@ -624,6 +631,7 @@ where
             dist_client: Rc::new(dist_client),
             storage: storage,
             compilers: Rc::new(RefCell::new(HashMap::new())),
+            compilers_pending: Rc::new(RefCell::new(HashMap::new())),
             pool: pool,
             creator: C::new(client),
             tx: tx,
@@ -740,19 +748,45 @@ where
             }
             None => {
                 trace!("compiler_info cache miss");
-                // Check the compiler type and return the result when
-                // finished. This generally involves invoking the compiler,
-                // so do it asynchronously.
-                let me = self.clone();
-
-                let info = get_compiler_info(&self.creator, &path, env, &self.pool);
-                Box::new(info.then(move |info| {
-                    let info = info.ok();
-                    me.compilers
-                        .borrow_mut()
-                        .insert(path, info.clone().map(|i| (i, mtime)));
-                    Ok(info)
-                }))
+                // A build usually starts many compiles with the same compiler
+                // at once. Only look it up once, and have the other requests
+                // wait for that lookup to finish.
+                let key = (path.clone(), mtime);
+                let pending = self.compilers_pending.borrow().get(&key).cloned();
+                let info = match pending {
+                    Some(info) => {
+                        trace!("compiler_info lookup already running");
+                        info
+                    }
+                    None => {
+                        // Check the compiler type and return the result when
+                        // finished. This generally involves invoking the compiler,
+                        // so do it asynchronously.
+                        let me = self.clone();
+                        let pending_key = key.clone();
+                        let info = get_compiler_info(&self.creator, &path, env, &self.pool);
+                        let info: SFuture<_> = Box::new(info.then(move |info| {
+                            let info = info.ok();
+                            me.compilers_pending.borrow_mut().remove(&pending_key);
+                            me.compilers
+                                .borrow_mut()
+                                .insert(path, info.clone().map(|i| (i, mtime)));
+                            Ok(info)
+                        }));
+                        let info = info.shared();
+                        self.compilers_pending
+                            .borrow_mut()
+                            .insert(key, info.clone());
+                        info
+                    }
+                };
+                // The lookup itself never fails, as errors are cached as
+                // `None`, but `Shared` wraps the error type so it still needs
+                // converting back.
+                Box::new(
+                    info.map(|info| (*info).clone())
+                        .map_err(|e| -> Error { e.to_string().into() }),
+                )
             }
         }
     }
@@ -798,7 +832,17 @@ where
                             debug!("parse_arguments: CannotCache({}): {:?}", why, cmd)
                         }
                         stats.requests_not_cacheable += 1;
-                        *stats.not_cached.entry(why.to_string()).or_insert(0) += 1;
+                        // Only allocate a key the first time a reason is seen.
+                        let counted = match stats.not_cached.get_mut(why) {
+                            Some(count) => {
+                                *count += 1;
+                                true
+                            }
+                            None => false,
+                        };
+                        if !counted {
+                            stats.not_cached.insert(why.to_owned(), 1);
+                        }
                     }
                     CompilerArguments::NotCompilation => {
                         debug!("parse_arguments: NotCompilation: {:?}", cmd);
@@ -945,8 +989,9 @@ where
                             info.object_file_pretty,
                             util::fmt_duration_as_secs(&info.duration)
                         );
-                        me.stats.borrow_mut().cache_writes += 1;
-                        me.stats.borrow_mut().cache_write_duration += info.duration;
+                        let mut stats = me.stats.borrow_mut();
+                        stats.cache_writes += 1;
+                        stats.cache_write_duration += info.duration;
                     }
 
                     Ok(None) => {}
@@ -1048,10 +1093,12 @@ impl Default for ServerStats {
 }
 
 impl ServerStats {
-    /// Print stats to stdout in a human-readable format.
+    /// Write stats to `out` in a human-readable format.
     ///
     /// Return the formatted width of each of the (name, value) columns.
-    fn print(&self) -> (usize, usize) {
+    fn write_to(&self, out: &mut String) -> (usize, usize) {
+        use std::fmt::Write;
+
         macro_rules! set_stat {
             ($vec:ident, $var:expr, $name:expr) => {{
                 // name, value, suffix length
@@ -1146,28 +1193,30 @@ impl ServerStats {
             .max()
             .unwrap();
         for (name, stat, suffix_len) in stats_vec {
-            println!(
+            drop(writeln!(
+                out,
                 "{:<name_width$} {:>stat_width$}",
                 name,
                 stat,
                 name_width = name_width,
                 stat_width = stat_width + suffix_len
-            );
+            ));
         }
         if !self.not_cached.is_empty() {
-            println!("\nNon-cacheable reasons:");
+            drop(writeln!(out, "\nNon-cacheable reasons:"));
             let mut counts: Vec<_> = self.not_cached.iter().collect();
             counts.sort_by(|(_, c1), (_, c2)| c1.cmp(c2).reverse());
             for (reason, count) in counts {
-                println!(
+                drop(writeln!(
+                    out,
                     "{:<name_width$} {:>stat_width$}",
                     reason,
                     count,
                     name_width = name_width,
                     stat_width = stat_width
-                );
+                ));
             }
-            println!("");
+            drop(writeln!(out, ""));
         }
         (name_width, stat_width)
     }
@@ -1176,13 +1225,19 @@ impl ServerStats {
 impl ServerInfo {
     /// Print info to stdout in a human-readable format.
     pub fn print(&self) {
-        let (name_width, stat_width) = self.stats.print();
-        println!(
+        use std::fmt::Write;
+
+        // Format everything first and write it out in one go, rather than
+        // locking and writing stdout once per line.
+        let mut out = String::new();
+        let (name_width, stat_width) = self.stats.write_to(&mut out);
+        drop(writeln!(
+            out,
             "{:<name_width$} {}",
             "Cache location",
             self.cache_location,
             name_width = name_width
-        );
+        ));
         for &(name, val) in &[
             ("Cache size", &self.cache_size),
             ("Max cache size", &self.max_cache_size),
@@ -1192,16 +1247,18 @@ impl ServerInfo {
                     Standalone(bytes) => (bytes.to_string(), "bytes".to_string()),
                     Prefixed(prefix, n) => (format!("{:.0}", n), format!("{}B", prefix)),
                 };
-                println!(
+                drop(writeln!(
+                    out,
                     "{:<name_width$} {:>stat_width$} {}",
                     name,
                     val,
                     suffix,
                     name_width = name_width,
                     stat_width = stat_width
-                );
+                ));
             }
         }
+        print!("{}", out);
     }
 }
 
@@ -1410,3 +1467,43 @@ impl Future for WaitUntilZero {
         }
     }
 }
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use cache::disk::DiskCache;
+    use mock_command::*;
+    use std::sync::Mutex;
+    use test::utils::*;
+
+    #[test]
+    fn test_compiler_info_concurrent_lookups() {
+        let f = TestFixture::new();
+        let pool = CpuPool::new(1);
+        let client = unsafe { Client::new() };
+        let storage = Arc::new(DiskCache::new(&f.tempdir.path().join("cache"), u64::MAX, &pool));
+        let (tx, _rx) = mpsc::channel(1);
+        let (_wait, info) = WaitUntilZero::new();
+        let service: SccacheService<Arc<Mutex<MockCommandCreator>>> = SccacheService::new(
+            DistClientContainer::new_disabled(),
+            storage,
+            &client,
+            pool,
+            tx,
+            info,
+        );
+        // Only one detection is mocked, so a second lookup would run out of
+        // children.
+        next_command(
+            &service.creator,
+            Ok(MockChild::new(exit_status(0), "foo\nbar\ngcc", "")),
+        );
+        let a = service.compiler_info(f.bins[0].clone(), &[]);
+        let b = service.compiler_info(f.bins[0].clone(), &[]);
+        let (a, b) = a.join(b).wait().unwrap();
+        assert!(a.is_some());
+        assert!(b.is_some());
+        assert_eq!(0, service.creator.lock().unwrap().children.len());
+        assert!(service.compilers_pending.borrow().is_empty());
+    }
+}
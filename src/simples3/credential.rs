@@ -26,6 +26,10 @@ use tokio_timer::Timeout;
 use errors::*;
 use util::RequestExt;
 
+lazy_static! {
+    static ref PROFILE_REGEX: Regex = Regex::new(r"^\[([^\]]+)\]$").unwrap();
+}
+
 /// AWS API access credentials, including access key, secret key, token (for IAM profiles), and
 /// expiration timestamp.
 #[derive(Clone, Debug)]
@@ -217,7 +221,6 @@ fn parse_credentials_file(file_path: &Path) -> Result<HashMap<String, AwsCredent
 
     let file = File::open(file_path)?;
 
-    let profile_regex = Regex::new(r"^\[([^\]]+)\]$").unwrap();
     let mut profiles: HashMap<String, AwsCredentials> = HashMap::new();
     let mut access_key: Option<String> = None;
     let mut secret_key: Option<String> = None;
@@ -233,7 +236,7 @@ fn parse_credentials_file(file_path: &Path) -> Result<HashMap<String, AwsCredent
         }
 
         // handle the opening of named profile blocks
-        if profile_regex.is_match(&unwrapped_line) {
+        if PROFILE_REGEX.is_match(&unwrapped_line) {
             if profile_name.is_some() && access_key.is_some() && secret_key.is_some() {
                 let creds = AwsCredentials::new(
                     access_key.unwrap(),
@@ -247,7 +250,7 @@ fn parse_credentials_file(file_path: &Path) -> Result<HashMap<String, AwsCredent
             access_key = None;
             secret_key = None;
 
-            let caps = profile_regex.captures(&unwrapped_line).unwrap();
+            let caps = PROFILE_REGEX.captures(&unwrapped_line).unwrap();
             profile_name = Some(caps.get(1).unwrap().as_str().to_string());
             continue;
         }
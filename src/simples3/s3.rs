@@ -3,12 +3,14 @@
 
 #[allow(unused_imports, deprecated)]
 use std::ascii::AsciiExt;
+use std::cmp;
 use std::fmt;
 
 use base64;
 use crypto::digest::Digest;
 use crypto::hmac::Hmac;
 use crypto::mac::Mac;
+use crypto::md5::Md5;
 use crypto::sha1::Sha1;
 use futures::{Future, Stream};
 use hyperx::header;
@@ -22,6 +24,10 @@ use time;
 use errors::*;
 use util::HeadersExt;
 
+/// The most that will be reserved up front for a response body, whatever
+/// its Content-Length claims. Larger bodies still grow the buffer as needed.
+const MAX_PREALLOCATED_BODY: u64 = 16 * 1024 * 1024;
+
 #[derive(Debug, Copy, Clone)]
 #[allow(dead_code)]
 /// Whether or not to use SSL.
@@ -58,6 +64,16 @@ fn signature(string_to_sign: &str, signing_key: &str) -> String {
     base64::encode_config::<Vec<u8>>(&s, base64::STANDARD)
 }
 
+/// Returns the base64-encoded MD5 digest of `content`, as sent in a
+/// `Content-MD5` header.
+pub fn content_md5(content: &[u8]) -> String {
+    let mut md5 = Md5::new();
+    md5.input(content);
+    let mut digest = [0; 16];
+    md5.result(&mut digest);
+    base64::encode_config::<[u8]>(&digest, base64::STANDARD)
+}
+
 /// An S3 bucket.
 pub struct Bucket {
     name: String,
@@ -90,22 +106,31 @@ impl Bucket {
                 .get(&url[..])
                 .send()
                 .chain_err(move || format!("failed GET: {}", url))
-                .and_then(|res| {
-                    if res.status().is_success() {
-                        let content_length = res
-                            .headers()
-                            .get_hyperx::<header::ContentLength>()
-                            .map(|header::ContentLength(len)| len);
-                        Ok((res.into_body(), content_length))
-                    } else {
-                        Err(ErrorKind::BadHTTPStatus(res.status().clone()).into())
-                    }
-                }).and_then(|(body, content_length)| {
-                    body.fold(Vec::new(), |mut body, chunk| {
+                .map(|res| {
+                    let status = res.status();
+                    let content_length = res
+                        .headers()
+                        .get_hyperx::<header::ContentLength>()
+                        .map(|header::ContentLength(len)| len);
+                    (res.into_body(), status, content_length)
+                }).and_then(|(body, status, content_length)| {
+                    // Always read the body, even for unsuccessful responses: a
+                    // response that is dropped half-read can't go back to the
+                    // client's connection pool, and every cache miss would then
+                    // pay for a fresh connection on the next request.
+                    // Sizing the buffer from Content-Length up front saves
+                    // regrowing and copying it while large entries stream in,
+                    // but don't trust the header with an unbounded allocation.
+                    let capacity =
+                        cmp::min(content_length.unwrap_or(0), MAX_PREALLOCATED_BODY) as usize;
+                    body.fold(Vec::with_capacity(capacity), |mut body, chunk| {
                         body.extend_from_slice(&chunk);
                         Ok::<_, reqwest::Error>(body)
                     }).chain_err(|| "failed to read HTTP body")
                     .and_then(move |bytes| {
+                        if !status.is_success() {
+                            bail!(ErrorKind::BadHTTPStatus(status));
+                        }
                         if let Some(len) = content_length {
                             if len != bytes.len() as u64 {
                                 bail!(format!(
@@ -123,7 +148,10 @@ impl Bucket {
         )
     }
 
-    pub fn put(&self, key: &str, content: Vec<u8>, creds: &AwsCredentials) -> SFuture<()> {
+    /// Store `content` under `key`. `content_md5` is the result of
+    /// `content_md5(&content)`, which S3 checks so that a corrupted upload
+    /// can't end up in the bucket.
+    pub fn put(&self, key: &str, content: Vec<u8>, content_md5: &str, creds: &AwsCredentials) -> SFuture<()> {
         let url = format!("{}{}", self.base_url, key);
         debug!("PUT {}", url);
         let mut request = Request::new(Method::PUT, url.parse().unwrap());
@@ -150,12 +178,15 @@ impl Bucket {
             "PUT",
             &date,
             key,
-            "",
+            content_md5,
             &canonical_headers,
             content_type,
             creds,
         );
         request.headers_mut().insert("Date", HeaderValue::from_str(&date).expect("Invalid date header"));
+        request
+            .headers_mut()
+            .insert("Content-MD5", HeaderValue::from_str(content_md5).expect("Invalid Content-MD5 header"));
         request
             .headers_mut()
             .set(header::ContentType(content_type.parse().unwrap()));
@@ -212,3 +243,14 @@ impl Bucket {
         format!("AWS {}:{}", creds.aws_access_key_id(), signature)
     }
 }
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    #[test]
+    fn test_content_md5() {
+        assert_eq!("1B2M2Y8AsgTpgAmY7PhCfg==", content_md5(b""));
+        assert_eq!("XUFAKrxLKna5cZ2REBfFkg==", content_md5(b"hello"));
+    }
+}